@@ -27,6 +27,8 @@ def test_cust_einsum():
                           np.einsum('njk,k -> nj', njk, k))
     assert np.array_equal(device.cust_einsum('njr,njk -> nkr', njr, njk),
                           np.einsum('njr,njk -> nkr', njr, njk))
+    assert np.array_equal(device.cust_einsum('njk,nj -> nk', njk, nj),
+                          np.einsum('njk,nj -> nk', njk, nj))
 
 def test_disable_gpu_acceleration():
     """
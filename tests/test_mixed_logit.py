@@ -3,6 +3,7 @@ import numpy as np
 import pytest
 from xlogit import MixedLogit
 from xlogit import device
+from xlogit import _kernels
 from pytest import approx
 device.disable_gpu_acceleration()
 
@@ -32,10 +33,10 @@ def test_log_likelihood():
     Xd =  X_[~y_, :].reshape(N, J - 1, K) - X_[y_, :].reshape(N, 1, K) 
 
     model = MixedLogit()
-    model._rvidx,  model._rvdist = np.array([True, True]), np.array(['n', 'n'])
+    model._setup_randvars_info(randvars, varnames)
     draws = model._generate_halton_draws(N, R, K)  # (N,Kr,R)
-    obtained_loglik = model._loglik_gradient(betas, Xd, None, draws, None, None, None, None, R,
-                                            return_gradient=False)
+    obtained_loglik = model._loglik_gradient(betas, Xd[:, :, []], Xd, None, None, draws, None, None, None,
+                                             None, None, R, return_gradient=False)
 
     # Compute expected log likelihood "by hand"
     X_, y_ = X.reshape(N, J, K), y.reshape(N, J, 1)
@@ -57,7 +58,7 @@ def test__transform_betas():
 
     # Compute log likelihood using xlogit
     model = MixedLogit()
-    model._rvidx,  model._rvdist = np.array([True, True]), np.array(['n', 'n'])
+    model._setup_randvars_info(randvars, varnames)
     draws = model._generate_halton_draws(N, R, K)  # (N,Kr,R)
     expected_betas = betas[None, [0, 1], None] + draws*betas[None, [2, 3], None]
     obtained_betas = model._transform_rand_betas(betas, draws)
@@ -90,10 +91,9 @@ def test_predict():
     X_ = X.reshape(N, J, K)
     
     model = MixedLogit()
-    model._rvidx,  model._rvdist = np.array([True, True]), np.array(['n', 'n'])
+    model._setup_randvars_info(randvars, varnames)
     model.alternatives =  np.array([1, 2])
     model.coeff_ = betas
-    model.randvars = randvars
     model._isvars, model._asvars, model._varnames = [], varnames, varnames
     model._fit_intercept = False
     model.coeff_names = np.array(["a", "b", "sd.a", "sd.b"])
@@ -116,6 +116,45 @@ def test_predict():
 
     assert np.array_equal(expec_ypred, y_pred) 
     assert expec_freq == freq
+    assert not model._scratch  # Work arrays are only kept during estimation
+
+
+@pytest.mark.parametrize("V_avail", [-100, -1000])
+def test_predict_unavailable(V_avail):
+    """
+    Ensures that unavailable alternatives with very large utilities do not
+    affect the predicted probabilities, also when the available ones have
+    very low utilities
+    """
+    model = MixedLogit()
+    model._setup_randvars_info(randvars, varnames)
+    model.alternatives = np.array([1, 2, 3])
+    model.coeff_ = np.array([1., 0, 0, 0])
+    model._isvars, model._asvars, model._varnames = [], varnames, varnames
+    model._fit_intercept = False
+    model.coeff_names = np.array(["a", "b", "sd.a", "sd.b"])
+    X_ = np.array([[700, 0], [V_avail, 0], [V_avail - 1, 0]])
+    _, proba = model.predict(X_, varnames, np.array([1, 2, 3]), np.array([1, 1, 1]),
+                             avail=np.array([0, 1, 1]), n_draws=R, return_proba=True)
+
+    assert proba == approx(np.array([[0, np.e/(1 + np.e), 1/(1 + np.e)]]))
+
+
+def test__prob_product_across_panels(monkeypatch):
+    """
+    Ensures that the products of the GPU path, which groups panels by their
+    number of observations, match the ones of the CPU path
+    """
+    panels = np.array([0, 0, 1, 2, 2, 2, 3, 4, 4])
+    prob = np.random.default_rng(0).uniform(size=(len(panels), R))
+    model = MixedLogit()
+    panel_info = model._setup_panel_info(panels)
+    expected = model._prob_product_across_panels(prob, panel_info)
+    # NumPy stands in for CuPy to run the GPU path with the same array module
+    monkeypatch.setattr(device, "_using_gpu", True)
+    obtained = model._prob_product_across_panels(prob, panel_info)
+
+    assert np.allclose(obtained, expected)
 
 
 def test_validate_inputs():
@@ -140,3 +179,68 @@ def test_gpu_not_available():
 
     """
     assert not MixedLogit.check_if_gpu_available()
+
+
+def test_fit_large_utilities():
+    """
+    Ensures that large utility values do not overflow the exponentials used to
+    compute the choice probabilities
+    """
+    model = MixedLogit()
+    model.fit(X*1000, y, varnames, alts, ids, randvars, n_draws=10, panels=panels,
+              maxiter=0, verbose=0, halton=True, init_coeff=np.repeat(.1, 4),
+              skip_std_errs=True)
+
+    assert np.isfinite(model.loglikelihood)
+
+
+@pytest.mark.skipif(not _kernels.numba_available, reason="Numba is not installed")
+def test__compute_probabilities_numba(monkeypatch):
+    """
+    Ensures that the fused Numba kernel matches the NumPy implementation of
+    the choice probabilities
+    """
+    rng = np.random.default_rng(0)
+    Vdf, Xdr = rng.normal(size=(N, J)), rng.normal(size=(N, J, K))
+    Br, avail = rng.normal(size=(N, K, R)), np.array([[1, 0]]*N)
+
+    # Separate models, as the outputs are stored in work arrays of the model
+    monkeypatch.setattr(_kernels, "use_numba_kernels", lambda: False)
+    expected = MixedLogit()._compute_probabilities(Vdf*100, Xdr, Br, avail, return_vp=True)
+    monkeypatch.setattr(_kernels, "use_numba_kernels", lambda: True)
+    obtained = MixedLogit()._compute_probabilities(Vdf*100, Xdr, Br, avail, return_vp=True)
+
+    for e, o in zip(expected, obtained):
+        assert np.allclose(e, o)
+
+
+def test_fit_single_precision():
+    """
+    Ensures that the estimation in single precision yields a log-likelihood
+    consistent with the one obtained in double precision
+    """
+    model = MixedLogit()
+    model.fit(X, y, varnames, alts, ids, randvars, n_draws=10, panels=panels,
+              maxiter=0, verbose=0, halton=True, init_coeff=np.repeat(.1, 4),
+              weights=np.ones(N*J), dtype=np.float32)
+
+    assert model.loglikelihood == pytest.approx(-1.473423, rel=1e-5)
+
+
+@pytest.mark.parametrize("use_numba", [False, True])
+def test__compute_probabilities_unavailable(monkeypatch, use_numba):
+    """
+    Ensures that unavailable alternatives with very large utilities do not
+    affect the choice probabilities
+    """
+    if use_numba and not _kernels.numba_available:
+        pytest.skip("Numba is not installed")
+    monkeypatch.setattr(_kernels, "use_numba_kernels", lambda: use_numba)
+    Vdf, avail = np.array([[1000., 1.]]), np.array([[0., 1.]])
+    Xdr, Br = np.zeros((1, 2, 1)), np.zeros((1, 1, R))
+    model = MixedLogit()
+    proba_n, proba_d, _ = model._compute_probabilities(Vdf, Xdr, Br, avail)
+
+    assert np.allclose(proba_n, 1/(1 + np.e))
+    assert np.allclose(proba_d[:, 0], 0)
+    assert np.allclose(proba_d[:, 1], np.e/(1 + np.e))
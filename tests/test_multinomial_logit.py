@@ -3,7 +3,7 @@ import numpy as np
 import pytest
 from xlogit import MultinomialLogit
 from pytest import approx
-from xlogit._optimize import _minimize
+from xlogit._optimize import _minimize, _cache_last_evaluation
 
 # Setup data used for tests
 X = np.array([[2, 1], [1, 3], [3, 1], [2, 4], [2, 1], [2, 4]])
@@ -69,6 +69,27 @@ def test_predict():
     
 
 
+@pytest.mark.parametrize("V_avail", [-100, -1000])
+def test_predict_unavailable(V_avail):
+    """
+    Ensures that unavailable alternatives with very large utilities do not
+    affect the predicted probabilities, also when the available ones have
+    very low utilities
+    """
+    model = MultinomialLogit()
+    model.alternatives = np.array([1, 2, 3])
+    model.coeff_ = np.array([1., 0])
+    model._isvars, model._asvars, model._varnames = [], varnames, varnames
+    model._fit_intercept = False
+    model.coeff_names = np.array(["a", "b"])
+    X_ = np.array([[700, 0], [V_avail, 0], [V_avail - 1, 0]])
+    _, proba = model.predict(X_, varnames, np.array([1, 2, 3]),
+                             np.array([1, 1, 1]), avail=np.array([0, 1, 1]),
+                             return_proba=True)
+
+    assert proba == approx(np.array([[0, np.e/(1 + np.e), 1/(1 + np.e)]]))
+
+
 def test__bfgs_optimization():
     """
     Ensure that the bfgs optimization properly processes the input for one
@@ -85,6 +106,26 @@ def test__bfgs_optimization():
     assert res['fun'] == approx(0.276999)
 
 
+def test__cache_last_evaluation():
+    """
+    Ensures that the last evaluation is only reused for the same betas and
+    arguments, and that a log-likelihood output does not replace a gradient
+    """
+    calls = []
+
+    def loglik_fn(betas, a, return_gradient=True):
+        calls.append(return_gradient)
+        return (a.sum(), a, a) if return_gradient else a.sum()
+
+    cached_fn = _cache_last_evaluation(loglik_fn)
+    betas, a, b = np.array([.1, .1]), np.ones(3), np.ones(4)
+    assert cached_fn(betas, a)[0] == 3
+    assert cached_fn(betas, a, return_gradient=False) == 3
+    assert cached_fn(betas, b, return_gradient=False) == 4
+    assert cached_fn(betas, b)[0] == 4
+    assert calls == [True, False, True]
+
+
 def test_fit():
     """
     Ensures the log-likelihood works for a single iterations with the default
@@ -96,3 +137,16 @@ def test_fit():
               verbose=0, weights=np.ones(N*J))
 
     assert model.loglikelihood == approx(-0.40443136)
+
+
+def test_fit_large_utilities():
+    """
+    Ensures that large utility values do not overflow the exponentials used to
+    compute the choice probabilities
+    """
+    model = MultinomialLogit()
+    model.fit(X*10000, y, varnames=varnames, alts=alts, ids=ids, maxiter=0,
+              verbose=0, init_coeff=np.array([-.1, -.1]), avail=np.ones(N*J),
+              skip_std_errs=True)
+
+    assert np.isfinite(model.loglikelihood)
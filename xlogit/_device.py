@@ -11,6 +11,7 @@ class Device():
     def __init__(self):
         self.np = numpy
         self._using_gpu = False
+        self._pinned_mem, self._pinned_nbytes, self._pinned_event = None, 0, None
         if _gpu_available:
             self.np = cupy
             self._using_gpu = True
@@ -31,20 +32,22 @@ class Device():
     def using_gpu(self):
         return self._using_gpu
     
-    def cust_einsum(self, expr, a, b):
-        """Efficient einsum for common expressions"""
+    def cust_einsum(self, expr, a, b, out=None):
+        """Efficient einsum for common expressions. ``out`` is only used by the (N,J,R) and (N,K,R) contractions"""
         if expr == 'njk,nkr -> njr':
             n, j, k = a.shape
             r = b.shape[-1]
-            return self.np.matmul(a.reshape(n, j, k), b).reshape(n, j, r)
+            return self.np.matmul(a.reshape(n, j, k), b, out=out).reshape(n, j, r)
         elif expr == 'njk,k -> nj':
             return self.np.matmul(a, b)
+        elif expr == 'njk,nj -> nk':
+            return self.np.matmul(a.transpose([0, 2, 1]), b[:, :, None])[:, :, 0]
         elif expr == 'njr,njk -> nkr':
             n, j, r = a.shape
             k = b.shape[-1]
             return self.np.matmul(
                 b.reshape(n, j, k).transpose([0, 2, 1]),
-                a.reshape(n, j, r))
+                a.reshape(n, j, r), out=out)
         else:
             return self.np.einsum(expr, a, b)
         
@@ -63,6 +66,26 @@ class Device():
         else:
             return arr
 
+    def to_gpu_pinned(self, arr):
+        """Copy array to the GPU through a reusable page-locked (pinned) host buffer.
+
+        Copies from pinned memory are faster than from pageable memory and do not block the host. The copy is queued
+        in the current stream, so it still runs after the kernels queued before it and does not overlap with them.
+        """
+        if not self._using_gpu or arr is None or isinstance(arr, cupy.ndarray):
+            return self.to_gpu(arr)
+        if self._pinned_event is not None:
+            self._pinned_event.synchronize()  # The previous copy must finish before reusing the buffer
+        if self._pinned_nbytes < arr.nbytes:
+            self._pinned_mem, self._pinned_nbytes = cupy.cuda.alloc_pinned_memory(arr.nbytes), arr.nbytes
+        staging = numpy.frombuffer(self._pinned_mem, arr.dtype, arr.size).reshape(arr.shape)
+        staging[...] = arr
+        stream = cupy.cuda.get_current_stream()
+        out = cupy.empty(arr.shape, dtype=arr.dtype)
+        out.set(staging, stream=stream)
+        self._pinned_event = stream.record()
+        return out
+
     def nan_safe_sum(self, arr, axis=0):
         arr[numpy.isnan(arr)] = 0
         return arr.sum(axis=axis)
@@ -0,0 +1,83 @@
+"""Fused computational kernels used when optional accelerators are installed."""
+# pylint: disable=invalid-name
+import math
+import numpy as np
+from ._device import _gpu_available
+
+numba_available = False
+try:
+    import numba
+    from numba import njit, prange
+    numba_available = True
+except ImportError:
+    pass
+
+
+def use_numba_kernels():
+    """Check whether the fused Numba kernels are expected to be faster than NumPy.
+
+    Without SVML, Numba evaluates ``exp`` one element at a time, which in a single thread is slower than NumPy's
+    vectorized ``exp``. Hence, the kernels are only used when SVML or multiple threads are available.
+    """
+    return numba_available and (numba.config.USING_SVML or numba.get_num_threads() > 1)
+
+
+if numba_available:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def mxl_proba_kernel(Vdf, Xdr, Br, avail, proba_n, proba_d, vp):
+        """Compute mixed logit choice probabilities on the CPU in a single pass.
+
+        Fuses the utility of the random parameters, the max-shifted exponentials and the normalization, which
+        avoids creating several (N,J-1,R) temporaries. ``proba_d`` is used as buffer for the utilities.
+
+        Parameters
+        ----------
+        Vdf : (N,J-1) utility differences for fixed parameters (including scale and additive terms)
+        Xdr : (N,J-1,Kr) data differences for random parameters
+        Br : (N,Kr,R) random coefficients
+        avail : (N,J-1) availability of non-chosen alternatives
+        proba_n : (N,R) output for the probability of the chosen alternative
+        proba_d : (N,J-1,R) output for the probabilities of the non-chosen alternatives
+        vp : (N,R) output for the probability-weighted sum of utility differences
+        """
+        N, J1, Kr = Xdr.shape
+        R = Br.shape[2]
+        for n in prange(N):
+            # Loops over draws are kept innermost so that they run over contiguous memory
+            V, Vmax, sum_eV, sum_VeV = proba_d[n], proba_n[n], np.empty(R), vp[n]
+            for j in range(J1):
+                for r in range(R):
+                    V[j, r] = Vdf[n, j]
+                for k in range(Kr):
+                    x = Xdr[n, j, k]
+                    for r in range(R):
+                        V[j, r] += x*Br[n, k, r]
+            for r in range(R):
+                Vmax[r] = 0.
+                sum_VeV[r] = 0.
+            for j in range(J1):
+                for r in range(R):
+                    Vmax[r] = max(Vmax[r], V[j, r]*avail[n, j])  # Only available alts.
+            for r in range(R):
+                sum_eV[r] = math.exp(-Vmax[r])
+            for j in range(J1):
+                for r in range(R):
+                    eV = math.exp((V[j, r] - Vmax[r])*avail[n, j])*avail[n, j]
+                    sum_VeV[r] += V[j, r]*eV
+                    sum_eV[r] += eV
+                    V[j, r] = eV
+            for r in range(R):
+                sum_eV[r] = 1/sum_eV[r]
+                proba_n[n, r] = math.exp(-Vmax[r])*sum_eV[r]
+                sum_VeV[r] *= sum_eV[r]
+            for j in range(J1):
+                for r in range(R):
+                    V[j, r] *= sum_eV[r]
+
+
+if _gpu_available:
+    import cupy
+
+    # Fuses the shift by the maximum utility, the exponential and the availability of alts. in a single GPU kernel
+    mxl_exp_shift = cupy.ElementwiseKernel('T v, T vmax, T avail', 'T eV', 'eV = exp((v - vmax)*avail)*avail',
+                                           'xlogit_mxl_exp_shift')
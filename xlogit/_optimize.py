@@ -18,13 +18,21 @@ def _bfgs(loglik_fn, x, args, maxiter=2000, tol=1e-10, gtol=1e-6, step_tol=1e-10
         while True:
             step = step/2
             s = step*d
-            resnew = loglik_fn(x + s, *args, **{'return_gradient': False})
+            # The full step is usually accepted, so its gradient is computed along with the log-likelihood to avoid
+            # re-evaluating it. Shorter steps are often rejected, so they only compute the log-likelihood
+            if step == 1:
+                resnew, gnew, grad_n_new = loglik_fn(x + s, *args, **{'return_gradient': True})
+                njev += 1
+            else:
+                resnew, grad_n_new = loglik_fn(x + s, *args, **{'return_gradient': False}), None
             nfev += 1
             if step > step_tol:
                 if resnew <= res or step < step_tol:
                     x = x + s
-                    resnew, gnew, grad_n = loglik_fn(x, *args, **{'return_gradient': True})
-                    njev += 1
+                    if grad_n_new is None:
+                        resnew, gnew, grad_n_new = loglik_fn(x, *args, **{'return_gradient': True})
+                        njev += 1
+                    grad_n = grad_n_new
                     break
             else:
                 step_tol_failed = True
@@ -71,6 +79,23 @@ def _bfgs(loglik_fn, x, args, maxiter=2000, tol=1e-10, gtol=1e-6, step_tol=1e-10
     return {'success': convergence, 'x': x, 'fun': res, 'message': message,
             'hess_inv': Hinv, 'grad_n':grad_n, 'grad':g, 'nit': nit, 'nfev': nfev, 'njev': njev}
     
+def _cache_last_evaluation(loglik_fn):
+    """Wrap loglik_fn so that a repeated call with the same betas and arguments reuses the last output.
+
+    A log-likelihood output can answer a later call that does not request the gradient, but not the other way around.
+    """
+    last = [None, None, False, None]  # Betas, arguments, whether the gradient was computed, and output
+
+    def cached_loglik_fn(betas, *args, return_gradient=True):
+        betas_key = betas.tobytes()
+        if (betas_key == last[0] and len(args) == len(last[1]) and all(a is b for a, b in zip(args, last[1]))
+                and (last[2] or not return_gradient)):
+            return last[3][0] if last[2] and not return_gradient else last[3]
+        output = loglik_fn(betas, *args, return_gradient=return_gradient)
+        last[:] = betas_key, args, return_gradient, output
+        return output
+    return cached_loglik_fn
+
 def _minimize(loglik_fn, x, args, method, tol, options):
     if method == "BFGS":
         return _bfgs(loglik_fn, x, args=args, tol=tol, **options)
@@ -1,17 +1,18 @@
 """Implements all the logic for mixed logit models."""
 
 # pylint: disable=invalid-name
-import scipy.stats
+import scipy.special
 from ._choice_model import ChoiceModel, diff_nonchosen_chosen
 from ._device import device as dev
 from .multinomial_logit import MultinomialLogit
-from ._optimize import _minimize, _numerical_hessian
+from ._optimize import _minimize, _numerical_hessian, _cache_last_evaluation
+from . import _kernels
 import numpy as np
-import warnings
 
 from scipy.stats import truncnorm
 
 TN = truncnorm(0, np.inf)
+CPU_BATCH_BYTES = 2**24  # Default size in bytes of the blocks of draws processed at once on the CPU
 
 """
 Notations
@@ -70,11 +71,13 @@ class MixedLogit(ChoiceModel):
         super(MixedLogit, self).__init__()
         self._rvidx = None  # Index of random variables (True when random var)
         self._rvdist = None  # List of mixing distributions of rand vars
+        self._scratch = {}  # Work arrays reused across evaluations of the log-likelihood
 
     def fit(self, X, y, varnames, alts, ids, randvars, isvars=None, weights=None, avail=None,  panels=None,
             base_alt=None, fit_intercept=False, init_coeff=None, maxiter=2000, random_state=None, n_draws=1000,
             halton=True, verbose=1, batch_size=None, halton_opts=None, tol_opts=None, robust=False, num_hess=False,
-            fixedvars=None, scale_factor=None, optim_method="BFGS", mnl_init=True, addit=None, skip_std_errs=False):
+            fixedvars=None, scale_factor=None, optim_method="BFGS", mnl_init=True, addit=None, skip_std_errs=False,
+            dtype=np.float64):
         """Fit Mixed Logit models.
 
         Parameters
@@ -157,7 +160,8 @@ class MixedLogit(ChoiceModel):
             Verbosity of messages to show during estimation. 0: No messages, 1: Some messages, 2: All messages
 
         batch_size : int, default=None
-            Size of batches used to avoid GPU memory overflow.
+            Size of batches used to avoid GPU memory overflow. On the CPU, a batch size that bounds the memory of
+            intermediate arrays is used by default.
             
         scale_factor : array-like, shape (n_samples*n_alts, ), default=None
             Scaling variable used for non-linear models. For WTP models, this is usually the negative of 
@@ -184,6 +188,12 @@ class MixedLogit(ChoiceModel):
 
         mnl_init: bool, default=True
             Whether to initialize coefficients using estimates from a multinomial logit
+
+        dtype: numpy dtype, default=np.float64
+            Floating point precision of the data and random draws used during estimation. ``np.float32`` halves the
+            memory usage and speeds up GPU processing at the cost of accuracy, so a larger ``ftol`` in ``tol_opts``
+            may be required. The log-likelihood and gradients are always accumulated in double precision.
+
         Returns
         -------
         None.
@@ -229,11 +239,26 @@ class MixedLogit(ChoiceModel):
                     betas[idx] = v
 
         Xd, scale_d, addit_d, avail = diff_nonchosen_chosen(X, y, scale, addit, avail)  # Setup Xd as Xij - Xi*
-        fargs = (Xd, panels, draws, weights, avail, scale_d, addit_d, mask, batch_size)
+        # Split data for fixed and random parameters once to avoid copies at every evaluation
+        Xdf = np.ascontiguousarray(Xd[:, :, self._fx_idx], dtype=dtype)  # Data for fixed parameters
+        Xdr = np.ascontiguousarray(Xd[:, :, self._rx_idx], dtype=dtype)  # Data for random parameters
+        Xd = None  # Release memory
+        draws = draws.astype(dtype, copy=False)
+        avail = avail if avail is None else avail.astype(dtype)
+        scale_d = scale_d if scale_d is None else scale_d.astype(dtype)
+        addit_d = addit_d if addit_d is None else addit_d.astype(dtype)
+        # Data that remains constant during estimation is copied to the GPU only once (no effect on the CPU)
+        Xdf, Xdr, avail = dev.to_gpu(Xdf), dev.to_gpu(Xdr), dev.to_gpu(avail)
+        scale_d, addit_d = dev.to_gpu(scale_d), dev.to_gpu(addit_d)
+        draws = dev.to_gpu(draws) if batch_size is None else draws  # Otherwise, batches are copied when needed
+        panel_info = self._setup_panel_info(panels)  # Constant during estimation
+        fargs = (Xdf, Xdr, panels, panel_info, draws, weights, avail, scale_d, addit_d, mask, batch_size)
         if scale_factor is not None:
             optim_method = "L-BFGS-B"
 
-        optim_res = _minimize(self._loglik_gradient, betas, args=fargs, method=optim_method, tol=tol['ftol'],
+        # Repeated evaluations at the same betas (e.g., after the line search or in the hessian) reuse the last output
+        loglik_fn = _cache_last_evaluation(self._loglik_gradient)
+        optim_res = _minimize(loglik_fn, betas, args=fargs, method=optim_method, tol=tol['ftol'],
                               options={'gtol': tol['gtol'], 'maxiter': maxiter, 'disp': verbose > 1})        
 
         if scale_factor is not None:
@@ -242,14 +267,15 @@ class MixedLogit(ChoiceModel):
         num_hess = num_hess if scale_factor is None else True
 
         if optim_method == "L-BFGS-B":
-            optim_res['grad_n'] = self._loglik_gradient(optim_res['x'], *fargs, return_gradient=True)[2]
+            optim_res['grad_n'] = loglik_fn(optim_res['x'], *fargs, return_gradient=True)[2]
 
         if skip_std_errs:
             optim_res['hess_inv'] = np.eye(len(optim_res['x']))
         else:
             if num_hess or optim_method == "L-BFGS-B":
-                optim_res['hess_inv'] = _numerical_hessian(optim_res['x'], self._loglik_gradient, args=fargs)            
+                optim_res['hess_inv'] = _numerical_hessian(optim_res['x'], loglik_fn, args=fargs)            
 
+        self._scratch = {}  # Release the work arrays once the estimation is done
         self._post_fit(optim_res, coef_names, X.shape[0], verbose, robust)
 
 
@@ -361,14 +387,14 @@ class MixedLogit(ChoiceModel):
         addit = 0 if addit is None else addit[:, :, None]
         
         #=== 2. Compute choice probabilities
-        Xf = X[:, :, ~self._rvidx]  # Data for fixed parameters
-        Xr = X[:, :, self._rvidx]  # Data for random parameters
+        Xf = X[:, :, self._fx_idx]  # Data for fixed parameters
+        Xr = X[:, :, self._rx_idx]  # Data for random parameters
         betas, Xr, avail = dev.to_gpu(betas), dev.to_gpu(Xr), dev.to_gpu(avail)
         lambdac, sca, addit = dev.to_gpu(lambdac), dev.to_gpu(sca), dev.to_gpu(addit)
         
         # Utility for fixed parameters
-        Bf = betas[np.where(~self._rvidx)[0]]  # Fixed betas
-        Vf = dev.np.einsum('njk,k -> nj', Xf, Bf)  # (N, J-1)
+        Bf = betas[self._fx_idx]  # Fixed betas
+        Vf = dev.cust_einsum('njk,k -> nj', Xf, Bf)  # (N, J-1)
         
         proba = []  # Temp batching storage
         for batch_start, batch_end in batches_idx(batch_size, n_draws):
@@ -378,8 +404,15 @@ class MixedLogit(ChoiceModel):
             Br = self._transform_rand_betas(betas, draws_)  # Get random coefficients
             Vr = dev.cust_einsum("njk,nkr -> njr", Xr, Br)  # (N,J-1,R)
             
-            eV = dev.np.exp(lambdac*(Vf[:, :, None] + Vr - sca + addit))
-            Vdr, Br = None, None # Release memory
+            V = lambdac*(Vf[:, :, None] + Vr - sca + addit)
+            Vr, Br = None, None # Release memory
+            # Shift by the largest utility of the available alts. to avoid overflow (probabilities are unchanged)
+            if avail is None:
+                V -= V.max(axis=1, keepdims=True)
+            else:
+                V -= dev.np.where(avail[:, :, None] > 0, V, -dev.np.inf).max(axis=1, keepdims=True)
+                V *= avail[:, :, None]  # Zero utility for unavailable alts. avoids overflow in the exponentials
+            eV = dev.np.exp(V, out=V)
 
             eV = eV if avail is None else eV*avail[:, :, None]  
             proba_ = eV/dev.np.sum(eV, axis=1, keepdims=True)  # (N,J,R)
@@ -424,11 +457,7 @@ class MixedLogit(ChoiceModel):
 
         if panels is not None:
             # Convert panel ids to indexes 
-            panels = panels.reshape(N, J)[:, 0]
-            panels_idx = np.empty(N)
-            for i, u in enumerate(np.unique(panels)):
-                panels_idx[np.where(panels==u)] = i
-            panels = panels_idx.astype(int)
+            panels = np.unique(panels.reshape(N, J)[:, 0], return_inverse=True)[1].ravel()
 
         # Reshape arrays in the format required for the rest of the estimation
         X = X.reshape(N, J, K)
@@ -477,77 +506,78 @@ class MixedLogit(ChoiceModel):
             else:
                 self._rvidx.append(False)
         self._rvidx = np.array(self._rvidx)
-
-    def _loglik_gradient(self, betas, Xd, panels, draws, weights, avail, scale_d, addit_d, mask, batch_size, return_gradient=True):
+        # Integer indexes of fixed and random vars, and order of the gradients of fixed, random and sd. coefficients
+        self._fx_idx, self._rx_idx = np.where(~self._rvidx)[0], np.where(self._rvidx)[0]
+        self._concat_perm = np.append(np.argsort(np.concatenate((self._fx_idx, self._rx_idx))),
+                                      np.arange(len(self._rvidx), len(self._rvidx) + len(self._rx_idx)))
+        # Random vars whose mixing distribution requires transforming the random betas
+        self._ln_idx = np.where(np.array(self._rvdist) == 'ln')[0]
+        self._tn_idx = np.where(np.array(self._rvdist) == 'tn')[0]
+        self._der_is_identity = not len(self._ln_idx) and not len(self._tn_idx)  # Derivatives of random betas are 1
+
+    def _loglik_gradient(self, betas, Xdf, Xdr, panels, panel_info, draws, weights, avail, scale_d, addit_d, mask,
+                         batch_size,
+                         return_gradient=True):
         """Compute the log-likelihood and gradient.
 
         Fixed and random parameters are handled separately to speed up the estimation and the results are concatenated.
         """
-        N, R, Kr, Kf = Xd.shape[0], draws.shape[2], np.sum(self._rvidx), np.sum(~self._rvidx)
+        N, R, Kr, Kf = Xdf.shape[0], draws.shape[2], len(self._rx_idx), len(self._fx_idx)
+        betas = betas.astype(draws.dtype, copy=False)  # Match the precision of the draws
         
         lambdac = 1 if scale_d is None else betas[-1]
-        Xd = Xd if scale_d is None else Xd*lambdac  # Multiply data by lambda coefficient when scaling is in use
-        
-        Xdf = Xd[:, :, ~self._rvidx]  # Data for fixed parameters
-        Xdr = Xd[:, :, self._rvidx]  # Data for random parameters
+        if scale_d is not None:  # Multiply data by lambda coefficient when scaling is in use
+            Xdf, Xdr = Xdf*lambdac, Xdr*lambdac
         
-        scad = 0 if scale_d is None else (lambdac*scale_d)[:, :, None]
-        additd = 0 if addit_d is None else (lambdac*addit_d)[:, :, None]
+        scad = 0 if scale_d is None else lambdac*scale_d
+        additd = 0 if addit_d is None else lambdac*addit_d
         betas, Xdf, Xdr, avail, scad, additd = dev.to_gpu(betas), dev.to_gpu(Xdf), dev.to_gpu(Xdr), dev.to_gpu(avail), dev.to_gpu(scad), dev.to_gpu(additd)
 
         # Utility for fixed parameters
-        Bf = betas[np.where(~self._rvidx)[0]]  # Fixed betas
-        Vdf = dev.np.einsum('njk,k -> nj', Xdf, Bf)  # (N, J-1)
+        Bf = betas[self._fx_idx]  # Fixed betas
+        Vdf = dev.cust_einsum('njk,k -> nj', Xdf, Bf) - scad + additd  # (N, J-1)
         
+        if batch_size is None and not dev.using_gpu:
+            # Process the draws in blocks to bound the memory used by the (N,J-1,R) intermediate arrays
+            batch_size = max(1, CPU_BATCH_BYTES//(Xdr.shape[0]*Xdr.shape[1]*draws.itemsize))
+
         proba, gr_f, gr_u, gr_s, gr_l = [], np.zeros((N, Kf)), np.zeros((N, Kr)), np.zeros((N, Kr)), np.zeros((N, 1))  # Temp batching storage
         for batch_start, batch_end in batches_idx(batch_size, n_samples=R):
-            draws_ = dev.to_gpu(draws[:, :, batch_start: batch_end])
-
-            # Utility for random parameters 
-            Br = self._transform_rand_betas(betas, draws_)  # Get random coefficients
-            Vdr = dev.cust_einsum("njk,nkr -> njr", Xdr, Br)  # (N,J-1,R)
-
-            Vd = Vdf[:, :, None] + Vdr - scad + additd
-            # print("Vd: ", np.max(Vd))
-            if dev.np.abs(dev.np.max(Vd)) > 700:
-                warnings.warn("Overflow in utility computation. Results may be inaccurate.", RuntimeWarning)
-                Vd = dev.np.clip(Vd, -700, 700)
-
+            draws_ = dev.to_gpu_pinned(draws[:, :, batch_start: batch_end])
 
-            eVd = dev.np.exp(Vd)
-            Vdr, Br = None, None # Release memory
-            eVd = eVd if avail is None else eVd*avail[:, :, None]  # Availablity of alts.
-            # TODO: Handle availability
-            proba_n = 1/(1+eVd.sum(axis=1)) # (N,R)
-            proba_ = self._prob_product_across_panels(proba_n, panels) # (Np,R)
+            Br = self._transform_rand_betas(betas, draws_, out=self._scratch_array('Br', draws_.shape, draws_.dtype))
+            proba_n, proba_d, vp = self._compute_probabilities(Vdf, Xdr, Br, avail,
+                                                               return_vp=return_gradient and scale_d is not None)
+            proba_ = self._prob_product_across_panels(proba_n, panel_info) # (Np,R)
             
             if return_gradient:
                 # The gradients are stored as a summation and at the end divided by R
-                pprod = proba_*proba_ if panels is None else proba_[panels]*proba_n
-                
-                # For fixed coefficients
-                dprod_f = -dev.np.einsum("njk,njr -> nkr", Xdf, eVd)  # (N,K,R)
-                der_prod_f = dprod_f*pprod[:, None, :]     # (N,K,R)
-                gr_f += dev.to_cpu((der_prod_f).sum(axis=2))  # (N,K)  
+                pprod = proba_ if panels is None else proba_[panels]
+                # Weight before contracting to avoid multiplying (N,K,R) temporaries afterwards. The weights are
+                # applied in place as the probabilities are not needed anymore
+                eVd_w = dev.np.multiply(proba_d, pprod[:, None, :], out=proba_d)  # (N,J-1,R)
+
+                # For fixed coefficients. The sum across draws is taken before contracting with the data, which is
+                # cheaper than one (N,K,R) contraction over all the data columns that is split into fixed and random
+                gr_f -= dev.to_cpu(dev.cust_einsum("njk,nj -> nk", Xdf, eVd_w.sum(axis=2)))  # (N,Kf)
                 
                 # For random coefficients
-                der = self._compute_derivatives(betas, draws_)  # (N,K,R)
-                dprod_r = -dev.np.einsum("njk,njr -> nkr", Xdr, eVd)  # (N,K,R)
-                der_prod_r = dprod_r*pprod[:, None, :]*der   # (N,K,R)
-                gr_u += dev.to_cpu((der_prod_r).sum(axis=2))  # (N,K)
-                gr_s += dev.to_cpu((der_prod_r*draws_).sum(axis=2))  # (N,K)
+                der_prod_r = dev.cust_einsum("njr,njk -> nkr", eVd_w, Xdr,
+                                             out=self._scratch_array('der_prod_r', Br.shape, Br.dtype))  # (N,Kr,R)
+                if not self._der_is_identity:
+                    der_prod_r *= self._compute_derivatives(Br, out=self._scratch_array('der', Br.shape, Br.dtype))
+                gr_u -= dev.to_cpu(der_prod_r.sum(axis=2))  # (N,K)
+                gr_s -= dev.to_cpu(dev.np.einsum("nkr,nkr -> nk", der_prod_r, draws_))  # (N,K)
                 
                 # For WTP lambda scaling
                 if scale_d is not None:
-                    dprod_l = -dev.np.einsum("njr,njr -> nr", dev.np.log(eVd)/lambdac, eVd)[:, None, :] # (N,K,R)
-                    der_prod_l = dprod_l*pprod[:, None, :]
-                    gr_l += dev.to_cpu((der_prod_l).sum(axis=2))
+                    gr_l -= dev.to_cpu((vp*pprod).sum(axis=1))[:, None]/lambdac
                     
                 
             proba_ = proba_.sum(axis=1)  # (N, )
             proba.append(dev.to_cpu(proba_))
 
-        lik = np.stack(proba).sum(axis=0)/R  # (N, )
+        lik = np.stack(proba).sum(axis=0, dtype=np.float64)/R  # (N, )
         lik = lik + 1e-200
         loglik = np.log(lik) if weights is None else np.log(lik)*weights
         loglik = loglik.sum()
@@ -573,54 +603,121 @@ class MixedLogit(ChoiceModel):
 
         return _unpack_tuple(output)
 
+    def _compute_probabilities(self, Vdf, Xdr, Br, avail, return_vp=False):
+        """Compute the choice probabilities using utility differences with respect to the chosen alternative.
+
+        Returns the probability of the chosen alternative (N,R), the probabilities of the non-chosen alternatives
+        (N,J-1,R) and, if ``return_vp`` is True, the probability-weighted sum of utility differences (N,R). A fused
+        Numba kernel is used on the CPU when available, and a fused CuPy kernel computes the exponentials on the GPU.
+        The (N,J-1,R) probabilities are stored in a work array that is overwritten by the next call.
+        """
+        N, J1, R = Xdr.shape[0], Xdr.shape[1], Br.shape[2]
+        dtype = Br.dtype
+        if not dev.using_gpu and _kernels.use_numba_kernels():
+            proba_n, vp = self._scratch_array('proba_n', (N, R), dtype), self._scratch_array('vp', (N, R), dtype)
+            proba_d = self._scratch_array('Vd', (N, J1, R), dtype)
+            avail = np.ones((N, J1), dtype) if avail is None else avail
+            _kernels.mxl_proba_kernel(Vdf, Xdr, Br, avail, proba_n, proba_d, vp)
+            return proba_n, proba_d, vp if return_vp else None
+
+        Vd = dev.cust_einsum("njk,nkr -> njr", Xdr, Br, out=self._scratch_array('Vd', (N, J1, R), dtype))
+        Vd += Vdf[:, :, None]  # (N,J-1,R)
+        Vd_ = None
+        if return_vp:
+            Vd_ = self._scratch_array('Vd_', (N, J1, R), dtype)
+            Vd_[...] = Vd
+
+        # Shift by the largest utility of the available alts. (zero for the chosen alt.) to compute the exponentials
+        # without overflow. As the largest shifted exponential is one, the denominator never needs a zero guard.
+        Vmax = dev.np.maximum((Vd if avail is None else Vd*avail[:, :, None]).max(axis=1), 0)  # (N,R)
+        if dev.using_gpu:
+            avail_ = Vd.dtype.type(1) if avail is None else avail[:, :, None]
+            eVd = _kernels.mxl_exp_shift(Vd, Vmax[:, None, :], avail_, Vd)  # Single kernel launch
+        else:
+            Vd -= Vmax[:, None, :]
+            if avail is not None:
+                Vd *= avail[:, :, None]  # Zero utility for unavailable alts. avoids overflow in the exponentials
+            eVd = dev.np.exp(Vd, out=Vd)
+            if avail is not None:
+                eVd *= avail[:, :, None]  # Availablity of alts.
+        eV0 = dev.np.exp(-Vmax)  # Shifted exp-utility of the chosen alternative
+        sum_eVd = eV0 + eVd.sum(axis=1)  # (N,R)
+        proba_n = eV0/sum_eVd  # (N,R)
+        proba_d = dev.np.divide(eVd, sum_eVd[:, None, :], out=eVd)  # (N,J-1,R)
+        vp = (Vd_*proba_d).sum(axis=1) if return_vp else None
+        return proba_n, proba_d, vp
+
+    def _scratch_array(self, name, shape, dtype):
+        """Get a work array that persists across evaluations of the log-likelihood to avoid reallocating it."""
+        key = (name, shape, dev.np.dtype(dtype).str, dev.using_gpu)
+        if key not in self._scratch:
+            self._scratch[key] = dev.np.empty(shape, dtype)
+        return self._scratch[key]
+
     def _concat_gradients(self, gr_f, gr_b, gr_w):
-        N, Kf, Kr = len(gr_f), (~self._rvidx).sum(), self._rvidx.sum()
-        gr = np.empty((N, Kf+2*Kr))
-        gr[:, np.where(~self._rvidx)[0]] = gr_f
-        gr[:, np.where(self._rvidx)[0]] = gr_b
-        gr[:, len(self._rvidx):] = gr_w
-        return gr
-
-    def _prob_product_across_panels(self, prob, panels):
-        if panels is not None:
-            idx = np.concatenate(([0], np.where(panels[:-1] != panels[1:])[0] + 1, [len(prob)]))
-            prob = dev.np.vstack([prob[idx[i]:idx[i+1]].prod(axis=0) for i in range(len(idx) - 1)])
+        return np.concatenate((gr_f, gr_b, gr_w), axis=1)[:, self._concat_perm]
+
+    def _setup_panel_info(self, panels):
+        """Compute the indexes used to multiply the probabilities across the observations of each panel.
+
+        Returns the first observation of each panel, used by ``reduceat`` on the CPU, and the groups of panels with the
+        same number of observations, used on the GPU as (length, panel positions, observation rows) on the device.
+        """
+        if panels is None:
+            return None
+        idx = np.concatenate(([0], np.where(panels[:-1] != panels[1:])[0] + 1))
+        lengths = np.diff(np.append(idx, len(panels)))
+        groups = []
+        for length in np.unique(lengths):
+            sel = np.where(lengths == length)[0]
+            rows = (idx[sel][:, None] + np.arange(length)).ravel()
+            groups.append((length, dev.to_gpu(sel), dev.to_gpu(rows)))
+        return idx, groups
+
+    def _prob_product_across_panels(self, prob, panel_info):
+        if panel_info is not None:
+            idx, groups = panel_info
+            if dev.using_gpu:
+                # Panels are grouped by their number of observations, so that the products of all panels with the
+                # same length are computed at once without padding the shorter panels
+                prob_ = dev.np.empty((len(idx), prob.shape[1]), dtype=prob.dtype)
+                for length, sel, rows in groups:
+                    prob_[sel] = prob[rows].reshape(len(sel), length, -1).prod(axis=1)
+                prob = prob_
+            else:
+                prob = np.multiply.reduceat(prob, idx, axis=0)  # Product for all panels in a single call
             
         return prob  # (Np,R)
 
     def _apply_distribution(self, betas_random):
         """Apply the mixing distribution to the random betas."""
-        for k, dist in enumerate(self._rvdist):
-            if dist == 'ln':
-                betas_random[:, k, :] = dev.np.exp(betas_random[:, k, :])
-            elif dist == 'tn':
-                betas_random[:, k, :] = betas_random[:, k, :] *\
-                    (betas_random[:, k, :] > 0)
+        if len(self._ln_idx):
+            betas_random[:, self._ln_idx, :] = dev.np.exp(betas_random[:, self._ln_idx, :])
+        if len(self._tn_idx):
+            betas_random[:, self._tn_idx, :] = dev.np.maximum(betas_random[:, self._tn_idx, :], 0)
         return betas_random
 
-    def _compute_derivatives(self, betas, draws):
-        """Compute the derivatives based on the mixing distributions."""
-        N, R, Kr = draws.shape[0], draws.shape[2], self._rvidx.sum()
-        der = dev.np.ones((N, Kr, R), dtype=draws.dtype)
-        if any(set(self._rvdist).intersection(['ln', 'tn'])):
-            betas_random = self._transform_rand_betas(betas, draws)
-            for k, dist in enumerate(self._rvdist):
-                if dist == 'ln':
-                    der[:, k, :] = betas_random[:, k, :]
-                elif dist == 'tn':
-                    der[:, k, :] = 1*(betas_random[:, k, :] > 0)
+    def _compute_derivatives(self, betas_random, out=None):
+        """Compute the derivatives based on the mixing distributions using the transformed random betas."""
+        der = dev.np.empty_like(betas_random) if out is None else out
+        der.fill(1)
+        if len(self._ln_idx):
+            der[:, self._ln_idx, :] = betas_random[:, self._ln_idx, :]
+        if len(self._tn_idx):
+            der[:, self._tn_idx, :] = betas_random[:, self._tn_idx, :] > 0
         return der
 
-    def _transform_rand_betas(self, betas, draws):
+    def _transform_rand_betas(self, betas, draws, out=None):
         """Compute the products between the betas and the random coefficients.
 
-        This method also applies the associated mixing distributions
+        This method also applies the associated mixing distributions. The result is written to ``out`` when given.
         """
         # Extract coeffiecients from betas array
-        br_mean = betas[np.where(self._rvidx)[0]]
-        br_sd = betas[len(self._rvidx):len(self._rvidx) + np.sum(self._rvidx)] 
+        br_mean = betas[self._rx_idx]
+        br_sd = betas[len(self._rvidx):len(self._rvidx) + len(self._rx_idx)]
         # Compute: betas = mean + sd*draws
-        betas_random = br_mean[None, :, None] + draws*br_sd[None, :, None]
+        betas_random = dev.np.multiply(draws, br_sd[None, :, None], out=out)
+        betas_random += br_mean[None, :, None]
         betas_random = self._apply_distribution(betas_random)
         return betas_random
 
@@ -632,17 +729,21 @@ class MixedLogit(ChoiceModel):
         else:
             draws = self._generate_random_draws(sample_size, n_draws, len(self._rvdist))
 
-        for k, dist in enumerate(self._rvdist):
-            if dist in ['n', 'ln', 'tn']:  # Normal based
-                draws[:, k, :] = scipy.stats.norm.ppf(draws[:, k, :])
-            elif dist == 't':  # Triangular
-                draws_k = draws[:, k, :]
-                draws[:, k, :] = (np.sqrt(2*draws_k) - 1)*(draws_k <= .5) +\
-                    (1 - np.sqrt(2*(1 - draws_k)))*(draws_k > .5)
-            elif dist == 'u':  # Uniform
-                draws[:, k, :] = 2*draws[:, k, :] - 1
-            elif dist == 'tn2':
-                draws[:, k, :] = TN.ppf(draws[:, k, :])
+        # Transform draws by groups of variables with the same type of mixing distribution
+        rvdist = np.array(self._rvdist)
+        norm_idx = np.where(np.isin(rvdist, ['n', 'ln', 'tn']))[0]  # Normal based
+        if len(norm_idx):
+            draws[:, norm_idx, :] = scipy.special.ndtri(draws[:, norm_idx, :])
+        tri_idx = np.where(rvdist == 't')[0]  # Triangular
+        if len(tri_idx):
+            draws_t = draws[:, tri_idx, :]
+            draws[:, tri_idx, :] = np.where(draws_t <= .5, np.sqrt(2*draws_t) - 1, 1 - np.sqrt(2*(1 - draws_t)))
+        unif_idx = np.where(rvdist == 'u')[0]  # Uniform
+        if len(unif_idx):
+            draws[:, unif_idx, :] = 2*draws[:, unif_idx, :] - 1
+        tn2_idx = np.where(rvdist == 'tn2')[0]
+        if len(tn2_idx):
+            draws[:, tn2_idx, :] = TN.ppf(draws[:, tn2_idx, :])
 
         return draws  # (N,Kr,R)
 
@@ -657,11 +758,12 @@ class MixedLogit(ChoiceModel):
                       103, 107, 109, 113, 127, 131, 137, 139, 149, 151, 157, 163, 167, 173, 179, 181, 191, 193, 197,
                       199, 211, 223, 227, 229, 233, 239, 241, 251, 257, 263, 269, 271, 277, 281, 283, 293, 307, 311]
         
-        def halton_seq(length, prime=3, shuffle=False, drop=100):
+        def halton_seq(length, prime=3, drop=100):
             """Generates a halton sequence while handling memory efficiently.
             
             Memory is efficiently handled by creating a single array ``seq`` that is iteratively filled without using
-            intermidiate arrays.
+            intermidiate arrays. For each digit ``t``, the new block of the sequence is computed at once by
+            broadcasting the multiples of ``1/prime**t`` over the already generated part of the sequence.
             """
             req_length = length + drop
             seq = np.empty(req_length)
@@ -671,21 +773,27 @@ class MixedLogit(ChoiceModel):
             while seq_idx < req_length:
                 d = 1/prime**t
                 seq_size = seq_idx
-                i = 1
-                while i < prime and seq_idx < req_length:
-                    max_seq = min(req_length - seq_idx, seq_size)
-                    seq[seq_idx: seq_idx+max_seq] = seq[:max_seq] + d*i
-                    seq_idx += max_seq
-                    i += 1
+                n_mult = min(prime - 1, -(-(req_length - seq_idx)//seq_size))  # Only the multiples that are needed
+                block = d*np.arange(1, n_mult + 1)[:, None] + seq[None, :seq_size]
+                max_seq = min(req_length - seq_idx, block.size)
+                seq[seq_idx: seq_idx+max_seq] = block.ravel()[:max_seq]
+                seq_idx += max_seq
                 t += 1
-            seq = seq[drop:length+drop]
+            return seq[drop:length+drop]
+
+        # Draws are written into a single preallocated array. Sequences are generated once per prime and only kept
+        # when they are reused, which happens when there are more variables than primes.
+        draws = np.empty((sample_size, n_vars, n_draws))
+        reuse_seqs, seqs = n_vars > len(primes), {}
+        for i in range(n_vars):
+            prime = primes[i % len(primes)]
+            seq = seqs[prime] if prime in seqs else halton_seq(sample_size*n_draws, prime=prime, drop=drop)
+            if reuse_seqs:
+                seqs[prime] = seq
             if shuffle:
+                seq = seq.copy() if reuse_seqs else seq
                 np.random.shuffle(seq)
-            return seq
-
-        draws = [halton_seq(sample_size*n_draws, prime=primes[i % len(primes)],
-                            shuffle=shuffle, drop=drop).reshape(sample_size, n_draws) for i in range(n_vars)]
-        draws = np.stack(draws, axis=1)
+            draws[:, i, :] = seq.reshape(sample_size, n_draws)
         return draws  # (N,Kr,R)
 
     def _model_specific_validations(self, randvars, Xnames):
@@ -723,9 +831,9 @@ class MixedLogit(ChoiceModel):
 
             # Compute log likelihood using xlogit
             model = MixedLogit()
-            model._rvidx,  model._rvdist = np.array([True, True]), np.array(['n', 'n'])
+            model._setup_randvars_info({'a': 'n', 'b': 'n'}, ['a', 'b'])
             draws = model._generate_halton_draws(N, R, K)  # (N,Kr,R)
-            model._loglik_gradient(betas, Xd, None, draws, None, None, None, None,
+            model._loglik_gradient(betas, Xd[:, :, []], Xd, None, None, draws, None, None, None, None, None,
                                    batch_size=R, return_gradient=False)
 
             print("{} GPU device(s) available. xlogit will use GPU processing".format(n_gpus))
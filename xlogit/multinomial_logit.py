@@ -258,7 +258,14 @@ class MultinomialLogit(ChoiceModel):
         betas = betas if scale_factor is None else betas[:-1]
 
         #=== 2. Compute choice probabilities
-        eV = np.exp(lambdac*(X.dot(betas) - sca + addit))
+        V = lambdac*(X.dot(betas) - sca + addit)
+        # Shift by the max utility of the available alts. to avoid overflow (does not change proba)
+        if avail is None:
+            V -= V.max(axis=1, keepdims=True)
+        else:
+            V -= np.where(avail > 0, V, -np.inf).max(axis=1, keepdims=True)
+            V *= avail  # Zero utility for unavailable alts. avoids overflow in the exponentials
+        eV = np.exp(V, out=V)
         eV = eV if avail is None else eV*avail
         proba = eV/np.sum(eV, axis=1, keepdims=True)  # (N,J)
         
@@ -324,22 +331,26 @@ class MultinomialLogit(ChoiceModel):
         additd = 0 if addit_d is None else lambdac*addit_d
         #p = self._compute_probabilities(betas, X, avail)
         Vd = np.einsum('njk,k -> nj', Xd, betas) - scad + additd
-        eVd = np.exp(Vd)
+        # Shift by the max utility (or zero for the chosen alt.) to avoid overflow in the exponentials. The shift is
+        # computed with a branchless maximum and only for available alts.
+        Vmax = np.maximum((Vd if avail is None else Vd*avail).max(axis=1), 0)  # (N, )
+        eVd = np.exp(Vd - Vmax[:, None] if avail is None else (Vd - Vmax[:, None])*avail)
         eVd = eVd if avail is None else eVd*avail # Availablity of alts.
-        proba = 1/(1+eVd.sum(axis=1))  # (N, )
+        eV0 = np.exp(-Vmax)
+        sum_eV = eV0 + eVd.sum(axis=1)
+        proba_d = eVd/sum_eV[:, None]  # (N, J-1) Proba of non-chosen alts.
         
-        # Log likelihood
-        lik = proba
-        loglik = np.log(lik) if weights is None else np.log(lik)*weights
+        # Log likelihood (log of eV0/sum_eV, computed in log space to avoid underflow of the proba)
+        loglik = -Vmax - np.log(sum_eV)  # (N, )
+        loglik = loglik if weights is None else loglik*weights
         loglik = np.sum(loglik)
         output = (-loglik, )
         # Individual contribution to the gradient
         if return_gradient:
-            grad_n = -np.einsum('njk,nj -> nk', Xd, eVd)
+            grad_n = -np.einsum('njk,nj -> nk', Xd, proba_d)
             if scale_d is not None:
-                gr_l = -np.einsum('nj,nj -> n', Vd/lambdac, eVd)[:, None]
+                gr_l = -np.einsum('nj,nj -> n', Vd/lambdac, proba_d)[:, None]
                 grad_n = np.append(grad_n, gr_l, 1)
-            grad_n = grad_n*proba[:, None]
             grad_n = grad_n if weights is None else grad_n*weights[:, None]
             grad = np.sum(grad_n, axis=0)
             output += (-grad.ravel(), )